@@ -1,21 +1,57 @@
+import socket
 import subprocess
 import time
-import urllib.request
 import os
 import sys
+import threading
 import webbrowser
 
+SERVER_CMD = [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", "8000"]
+
+def server_is_up(timeout=0.2):
+    """True se qualcosa è già in ascolto sulla porta 8000 (probe TCP, niente HTTP)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        return s.connect_ex(("127.0.0.1", 8000)) == 0
+
 def wait_for_server():
-    """Aspetta che Uvicorn risponda sulla porta 8000"""
-    max_retries = 15
-    for _ in range(max_retries):
-        try:
-            req = urllib.request.Request("http://127.0.0.1:8000")
-            with urllib.request.urlopen(req, timeout=1):
-                return True
-        except Exception:
-            time.sleep(1)
+    """Aspetta che Uvicorn sia in ascolto sulla porta 8000"""
+    deadline = time.monotonic() + 15
+    delay = 0.025  # backoff esponenziale: uvicorn di solito parte in 200-400ms
+    while time.monotonic() < deadline:
+        if server_is_up():
+            return True
+        time.sleep(delay)
+        delay = min(delay * 1.5, 0.5)
     return False
+
+def spawn_server_posix():
+    """Avvia uvicorn in una nuova sessione con posix_spawn (niente fork dell'interprete)"""
+    try:
+        devnull_actions = [
+            (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+            (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0),
+        ]
+        os.posix_spawn(sys.executable, SERVER_CMD, os.environ,
+                       file_actions=devnull_actions, setsid=True)
+    except (AttributeError, NotImplementedError):
+        # Fallback: piattaforma senza posix_spawn o senza POSIX_SPAWN_SETSID
+        subprocess.Popen(
+            SERVER_CMD,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+def resolve_browser(holder):
+    """Risolve in anticipo il controller del browser (su macOS costa qualche decina di ms)"""
+    if os.name != 'posix':
+        return
+    try:
+        holder.append(webbrowser.get('macosx'))
+    except Exception:
+        pass  # main() ripiega su webbrowser.open
+
 def main():
     if os.name == 'posix':
         # MacOS / Linux: daemonize base e sgancio dal terminale
@@ -24,27 +60,31 @@ def main():
                 sys.exit()
         except AttributeError:
             pass # Fallback di sicurezza
-            
-        subprocess.Popen(
-            [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", "8000"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            start_new_session=True
-        )
-    else:
-        # Windows: sgancia dal cmd e nascondi la finestra (DETACHED_PROCESS | CREATE_NO_WINDOW)
-        subprocess.Popen(
-            [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", "8000"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            creationflags=0x08000008
-        )
+
+    # Se il server è già avviato (launcher lanciato due volte) apri solo il browser
+    if not server_is_up(timeout=0.1):
+        if os.name == 'posix':
+            spawn_server_posix()
+        else:
+            # Windows: sgancia dal cmd e nascondi la finestra (DETACHED_PROCESS | CREATE_NO_WINDOW)
+            subprocess.Popen(
+                SERVER_CMD,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                creationflags=0x08000008
+            )
+
+    # Risolve il controller del browser mentre uvicorn si avvia
+    browser_holder = []
+    warmup = threading.Thread(target=resolve_browser, args=(browser_holder,), daemon=True)
+    warmup.start()
 
     if wait_for_server():
+        warmup.join()
         # Usa il modulo webbrowser di Python per aprire il browser
         try:
             if os.name == 'posix':
-                browser = webbrowser.get('macosx')
+                browser = browser_holder[0]
                 browser.open('http://127.0.0.1:8000?fresh=true')
             else:
                 webbrowser.open('http://127.0.0.1:8000?fresh=true')
@@ -3,20 +3,21 @@ FastAPI backend for the Expense Management App.
 Handles file upload/ingestion, expense querying, and toggle exclusion.
 """
 import hashlib
-import io
-import re
-from collections import defaultdict
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict
 from contextlib import asynccontextmanager
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import BinaryIO
 
-import pandas as pd
+import orjson
 from fastapi import FastAPI, UploadFile, File, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from starlette.requests import Request
 
-from backend.models import init_db, get_db_connection
+from backend.models import init_db, get_db_connection, close_db_connection
 
 # ── Italian month names for grouping ──────────────────────────────
 MONTH_NAMES_IT = {
@@ -25,40 +26,119 @@ MONTH_NAMES_IT = {
     9: "Settembre", 10: "Ottobre", 11: "Novembre", 12: "Dicembre"
 }
 
+# ── Excel export layout ───────────────────────────────────────────
+# Excel header → internal column key used by the ingestion DataFrame
+EXCEL_COLUMNS = {
+    'Data': 'data',
+    'Operazione': 'operazione',
+    'Conto o carta': 'conto_carta',
+    'Categoria': 'categoria',
+    'Valuta': 'valuta',
+    'Importo': 'importo',
+}
+EXCEL_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d.%m.%Y')
+EXCEL_HEADER_ROW = 18  # 0-based: the bank export has 18 preamble rows
+# pd.read_excel's default na_values: cells exactly equal to one of these
+# (no stripping, case-sensitive) were read as NaN
+EXCEL_NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null',
+})
+
+# Deletes currency symbols and every Unicode whitespace char (same set as
+# regex \s, e.g. the NBSP Excel uses as thousands separator) in one C pass
+CURRENCY_STRIP_TABLE = str.maketrans(
+    '', '', '€$£' + ''.join(c for c in map(chr, range(0x3001)) if c.isspace())
+)
+
 
 # ── App Lifespan ──────────────────────────────────────────────────
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize DB on startup."""
+    """Initialize DB and load the (static) index page on startup, release the DB on shutdown."""
     init_db()
+    rehash_legacy_expenses()
+    with open("frontend/index.html", "rb") as f:
+        app.state.index_html = f.read()
     yield
+    close_db_connection()
 
-app = FastAPI(lifespan=lifespan)
 
+# ── JSON responses via orjson ─────────────────────────────────────
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, several times faster than stdlib json."""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
 
-# ── Middleware: No-Cache for Dev ──────────────────────────────────
-class NoCacheMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        if request.url.path.startswith("/static") or request.url.path == "/":
-            response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-            response.headers["Pragma"] = "no-cache"
-            response.headers["Expires"] = "0"
-        return response
 
-app.add_middleware(NoCacheMiddleware)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 # ── Static files ──────────────────────────────────────────────────
-app.mount("/static", StaticFiles(directory="frontend"), name="static")
+class RevalidatedStaticFiles(StaticFiles):
+    """
+    StaticFiles that always makes the browser revalidate, but lets it keep
+    a copy: unchanged files are answered with a body-less 304.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+app.mount("/static", RevalidatedStaticFiles(directory="frontend"), name="static")
+
+# No caching at all for the entry page, so new asset URLs are always seen
+INDEX_HEADERS = {
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
 
 
 # ── Helpers ───────────────────────────────────────────────────────
 
-def get_neutral_keywords(conn) -> set:
-    """Return set of lowercase neutral keywords from the DB."""
-    rows = conn.execute("SELECT keyword FROM neutral_keywords").fetchall()
-    return {r['keyword'].lower() for r in rows}
+# The keyword table is tiny and rarely written, but read on every insert/update:
+# keep it in memory and drop the copy whenever an endpoint writes to it.
+_neutral_cache = None
+_neutral_lock = threading.Lock()
+
+
+def get_neutral_keywords(conn) -> frozenset:
+    """Return set of lowercase neutral keywords, loaded from the DB on first use."""
+    global _neutral_cache
+    with _neutral_lock:
+        if _neutral_cache is None:
+            rows = conn.execute("SELECT keyword FROM neutral_keywords").fetchall()
+            _neutral_cache = frozenset(r['keyword'].lower() for r in rows)
+        return _neutral_cache
+
+
+def invalidate_neutral_keywords():
+    """Forget the cached keyword set. Call after committing a neutral_keywords change."""
+    global _neutral_cache
+    with _neutral_lock:
+        _neutral_cache = None
+
+
+# /expenses is re-fetched after every change, and the table only changes
+# through this app: keep the serialised responses per filter set and drop
+# them all on every write. The generation makes the ETag change with them.
+EXPENSES_CACHE_SIZE = 32  # LRU: the least recently served filter set is evicted
+EXPENSES_ETAG_PREFIX = os.urandom(4).hex()  # new ETags after a restart
+_expenses_cache = OrderedDict()
+_expenses_generation = 0
+_expenses_lock = threading.Lock()
+
+
+def invalidate_expenses_cache():
+    """Drop cached /expenses responses. Call after committing any change to expenses."""
+    global _expenses_generation
+    with _expenses_lock:
+        _expenses_cache.clear()
+        _expenses_generation += 1
 
 
 def check_neutral(operazione: str, neutral_kws: set) -> bool:
@@ -83,20 +163,13 @@ def parse_importo(value) -> float:
     if isinstance(value, (int, float)):
         return float(value)
 
-    s = str(value).strip()
-    # Remove currency symbols and whitespace
-    s = re.sub(r'[€$£\s]', '', s)
-
-    has_dot = '.' in s
-    has_comma = ',' in s
+    # Remove currency symbols and whitespace (the table covers what strip() would)
+    s = str(value).translate(CURRENCY_STRIP_TABLE)
 
-    if has_dot and has_comma:
-        # Italian format: "1.200,50" — dots are thousands separators
-        # The comma must be the decimal separator (Italian convention)
+    if ',' in s:
+        # Italian format: "1.200,50" or "10,3" — the comma is the decimal
+        # separator, so any dots are thousands separators
         s = s.replace('.', '').replace(',', '.')
-    elif has_comma and not has_dot:
-        # Only comma: treat as Italian decimal separator "10,3" → "10.3"
-        s = s.replace(',', '.')
     # else: only dot or no separator → standard float format, leave as-is
 
     try:
@@ -106,9 +179,40 @@ def parse_importo(value) -> float:
 
 
 def generate_hash(data_valuta: str, importo: float, operazione: str, conto_carta: str) -> str:
-    """Generate a unique hash for duplicate detection."""
+    """
+    Generate a unique hash for duplicate detection.
+    Not a security boundary: BLAKE2b-128 is faster than SHA-256 and halves the
+    key stored in the hash_id index (32 hex chars instead of 64).
+    """
     raw = f"{data_valuta}|{importo:.2f}|{operazione.strip().lower()}|{conto_carta.strip().lower()}"
-    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# PRAGMA user_version once every hash_id is BLAKE2b-128
+HASH_MIGRATION_VERSION = 1
+
+
+def rehash_legacy_expenses():
+    """Migration: recompute hash_ids still in the old 64-char SHA-256 form."""
+    conn = get_db_connection()
+    # Runs once per database: the full scan is skipped on later start-ups
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= HASH_MIGRATION_VERSION:
+        conn.close()
+        return
+
+    rows = conn.execute("""
+        SELECT id, data_valuta, importo, operazione, conto_carta
+        FROM expenses WHERE LENGTH(hash_id) = 64
+    """).fetchall()
+    if rows:
+        conn.executemany("UPDATE expenses SET hash_id = ? WHERE id = ?", [
+            (generate_hash(r['data_valuta'], r['importo'], r['operazione'], r['conto_carta'] or ''), r['id'])
+            for r in rows
+        ])
+    # Bumped in the same transaction as the rehash
+    conn.execute(f"PRAGMA user_version = {HASH_MIGRATION_VERSION}")
+    conn.commit()
+    conn.close()
 
 
 def month_date_range(year: int, month: int) -> tuple:
@@ -139,7 +243,8 @@ def parse_expense_body(body: dict):
     importo = parse_importo(importo_raw)
 
     try:
-        datetime.strptime(data_valuta, '%Y-%m-%d')
+        # Stored zero-padded so string ordering and slicing by position hold
+        data_valuta = datetime.strptime(data_valuta, '%Y-%m-%d').date().isoformat()
     except ValueError:
         return None, None, None, None, None, JSONResponse(
             status_code=400,
@@ -149,95 +254,227 @@ def parse_expense_body(body: dict):
     return data_valuta, operazione, categoria, conto_carta, importo, None
 
 
-def check_fuzzy_duplicate(conn, data_valuta: str, importo: float, operazione: str) -> bool:
+def load_duplicate_index(conn, first_date: str, last_date: str) -> tuple:
+    """
+    Load everything duplicate detection needs for rows dated first_date..last_date
+    with a single query. Returns (hashes, fuzzy_days):
+      hashes     — set of hash_id of the existing rows in (and around) the range
+      fuzzy_days — {(importo, operazione lower): sorted date ordinals}, widened by
+                   ±2 days so rows at the edges of the range are still matched
+    """
+    start = (date.fromisoformat(first_date) - timedelta(days=2)).isoformat()
+    end = (date.fromisoformat(last_date) + timedelta(days=2)).isoformat()
+
+    hashes = set()
+    fuzzy_days = defaultdict(list)
+    for r in conn.execute("""
+        SELECT hash_id, data_valuta, importo, operazione FROM expenses
+        WHERE data_valuta BETWEEN ? AND ?
+    """, (start, end)):
+        hashes.add(r['hash_id'])
+        try:
+            day = date.fromisoformat(r['data_valuta'])
+        except ValueError:
+            # Rows saved before data_valuta was normalised may be unpadded
+            # ('2024-1-7'); anything strptime rejects too is left out.
+            try:
+                day = datetime.strptime(r['data_valuta'], '%Y-%m-%d').date()
+            except ValueError:
+                continue
+        key = (r['importo'], r['operazione'].strip().lower())
+        fuzzy_days[key].append(day.toordinal())
+
+    for days in fuzzy_days.values():
+        days.sort()
+    return hashes, fuzzy_days
+
+
+def check_fuzzy_duplicate(fuzzy_days: dict, day: int, importo: float, operazione: str) -> bool:
     """
     Fuzzy duplicate check: same importo + operazione within ±2 days.
-    Returns True if a fuzzy match is found.
+    `day` is a date ordinal, `fuzzy_days` comes from load_duplicate_index().
+    Zero amounts carry no signal and are never treated as fuzzy duplicates.
     """
-    try:
-        target_date = datetime.strptime(data_valuta, '%Y-%m-%d')
-    except ValueError:
+    if importo == 0:
+        return False
+    days = fuzzy_days.get((importo, operazione.strip().lower()))
+    if not days:
         return False
+    return bisect_left(days, day - 2) < bisect_right(days, day + 2)
 
-    date_minus = (target_date - timedelta(days=2)).strftime('%Y-%m-%d')
-    date_plus = (target_date + timedelta(days=2)).strftime('%Y-%m-%d')
 
-    cursor = conn.execute("""
-        SELECT COUNT(*) FROM expenses
-        WHERE importo = ?
-          AND LOWER(TRIM(operazione)) = ?
-          AND data_valuta BETWEEN ? AND ?
-    """, (importo, operazione.strip().lower(), date_minus, date_plus))
+def find_best_window(amounts: list, tx_amount: float, tolleranza: float):
+    """
+    Best run of 1..4 consecutive monthly amounts whose total matches tx_amount
+    within tolleranza. Returns (start, end, total, diff), end inclusive and diff
+    rounded to cents, or None.
+    """
+    best = None
+    n = len(amounts)
+    # With amounts all of one sign |cumulative| only grows along a window, so
+    # once it overshoots tx_amount + tolleranza no longer window can match
+    one_sign = n > 0 and (min(amounts) >= 0 or max(amounts) <= 0)
+    for start_idx in range(n):
+        # Each window extends the previous one by a month: no re-summing
+        cumulative = 0.0
+        for end_idx in range(start_idx, min(start_idx + 4, n)):
+            cumulative += amounts[end_idx]
+            if one_sign and abs(cumulative) - tx_amount > tolleranza:
+                break
+            diff = abs(abs(cumulative) - tx_amount)
+            if diff <= tolleranza and (best is None or diff < best[3]):
+                # The diff is kept rounded: later windows compare against the cent value
+                best = (start_idx, end_idx, cumulative, round(diff, 2))
+    return best
+
+
+def read_excel_rows(file: BinaryIO):
+    """
+    Read the first sheet straight from calamine into a DataFrame with the
+    EXCEL_COLUMNS field names (missing columns and empty cells are NaN).
+    Skips pd.read_excel's per-cell conversion and TextParser pass.
+    """
+    # pandas is only needed for ingestion: importing it lazily keeps it
+    # off the server start-up path (~200 ms before the first response).
+    import pandas as pd
+    from python_calamine import CalamineWorkbook
 
-    count = cursor.fetchone()[0]
-    return count > 0
+    wb = CalamineWorkbook.from_filelike(file)
+    try:
+        cells = wb.get_sheet_by_index(0).to_python(skip_empty_area=False)
+    finally:
+        wb.close()
+
+    if len(cells) <= EXCEL_HEADER_ROW:
+        raise ValueError("Intestazione non trovata nel file.")
+
+    header = [str(c).strip() for c in cells[EXCEL_HEADER_ROW]]
+    body = cells[EXCEL_HEADER_ROW + 1:]
+    del cells
+
+    # Only the six known columns are copied out of the cell lists, so wide
+    # exports never become a full-width DataFrame. Cells get the conversions
+    # pd.read_excel applied: blanks and EXCEL_NA_VALUES become NaN (missing
+    # amounts still count as errors) and whole-number floats become int, so a
+    # numeric Operazione is stored (and hashed) as '12345', not '12345.0'.
+    nan = float('nan')
+    columns = {}
+    for label, name in EXCEL_COLUMNS.items():
+        if label in header:
+            i = header.index(label)
+            columns[name] = [
+                nan if v in EXCEL_NA_VALUES else int(v) if isinstance(v, float) and v.is_integer() else v
+                for v in (row[i] for row in body)
+            ]
+        else:
+            columns[name] = [nan] * len(body)
+    return pd.DataFrame(columns)
 
 
-def process_excel(file_bytes: bytes) -> dict:
+def parse_excel_dates(col):
     """
-    Process an Excel file and insert new expenses into the database.
-    Returns stats: { new, duplicates, fuzzy_matches, errors }.
+    Vectorised version of the per-cell date parsing for the 'Data' column.
+    Date cells are taken as-is, strings must match one of EXCEL_DATE_FORMATS.
+    Returns a Series of 'YYYY-MM-DD' strings, NaN where the cell could not be parsed.
     """
-    df = pd.read_excel(
-        io.BytesIO(file_bytes),
-        header=18,
-        engine='openpyxl'
-    )
+    import pandas as pd
 
-    df.columns = df.columns.str.strip()
-    df = df.dropna(how='all')
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.dt.strftime('%Y-%m-%d')
+
+    text = col.where(col.map(lambda v: isinstance(v, str))).str.strip()
+    parsed = pd.to_datetime(col.where(col.map(lambda v: isinstance(v, date))), errors='coerce')
+    for fmt in EXCEL_DATE_FORMATS:
+        parsed = parsed.fillna(pd.to_datetime(text, format=fmt, errors='coerce'))
+    return parsed.dt.strftime('%Y-%m-%d')
+
+
+def parse_importo_column(col):
+    """
+    Vectorised parse_importo() for the 'Importo' column: numeric cells are kept,
+    strings go through the same Italian/standard format rules with pandas
+    string ops. Results match parse_importo() cell by cell; empty cells stay NaN.
+    """
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype(float)
+
+    # Missing cells (NaN/None) count as numeric so they stay NaN, not 0.0
+    is_num = col.map(lambda v: isinstance(v, (int, float))) | col.isna()
+    s = col.where(~is_num, '').astype(str).str.strip().str.translate(CURRENCY_STRIP_TABLE)
+    # Both separators → Italian "1.200,50": drop the thousands dots. After that
+    # any remaining comma is a decimal separator ("10,3" or the case above).
+    italian = s.str.contains('.', regex=False) & s.str.contains(',', regex=False)
+    s = s.mask(italian, s.str.replace('.', '', regex=False)).str.replace(',', '.', regex=False)
+    parsed = pd.to_numeric(s, errors='coerce')
+    # to_numeric rejects some strings float() accepts ('1_000') and reads 'nan'
+    # like a failure: re-run what it could not parse through parse_importo so
+    # both paths agree (unparseable → 0.0, 'nan' → NaN)
+    failed = parsed.isna() & ~is_num
+    parsed[failed] = s[failed].map(parse_importo)
+
+    return pd.to_numeric(col.where(is_num), errors='coerce').where(is_num, parsed)
+
+
+def process_excel(file: BinaryIO) -> dict:
+    """
+    Process an Excel file (binary file object) and insert new expenses into the database.
+    Returns stats: { new, duplicates, fuzzy_matches, errors }.
+    """
+    df = read_excel_rows(file).dropna(how='all')
+    df = df.fillna({'operazione': '', 'conto_carta': '', 'categoria': '', 'valuta': 'EUR'})
 
     stats = {"new": 0, "duplicates": 0, "fuzzy_matches": [], "errors": 0}
-    conn = get_db_connection()
-    neutral_kws = get_neutral_keywords(conn)
 
-    try:
-        for _, row in df.iterrows():
-            try:
-                data_raw = row.get('Data', None)
-                if pd.isna(data_raw):
-                    continue
+    # Column-wise normalisation: rows without a date are skipped, rows with an
+    # unparseable one count as errors, rows without an operazione are skipped.
+    dates = parse_excel_dates(df['data'])
+    stats["errors"] += int((df['data'].notna() & dates.isna()).sum())
+    df = df[dates.notna()].assign(data_valuta=dates)
+    df = df.assign(**{
+        col: df[col].astype(str).str.strip()
+        for col in ('operazione', 'conto_carta', 'categoria', 'valuta')
+    })
+    df = df[df['operazione'] != '']
+    df = df.assign(importo=parse_importo_column(df['importo']))
+    # A missing amount would violate NOT NULL and abort the whole batch insert
+    stats["errors"] += int(df['importo'].isna().sum())
+    df = df[df['importo'].notna()]
 
-                if isinstance(data_raw, datetime):
-                    data_valuta = data_raw.strftime('%Y-%m-%d')
-                elif isinstance(data_raw, str):
-                    for fmt in ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d.%m.%Y'):
-                        try:
-                            data_valuta = datetime.strptime(data_raw.strip(), fmt).strftime('%Y-%m-%d')
-                            break
-                        except ValueError:
-                            continue
-                    else:
-                        stats["errors"] += 1
-                        continue
-                else:
-                    stats["errors"] += 1
-                    continue
+    conn = get_db_connection()
+    neutral_kws = get_neutral_keywords(conn)
+    df = df.assign(is_neutral=df['operazione'].str.lower().isin(neutral_kws).astype(int))
 
-                operazione = str(row.get('Operazione', '')).strip()
-                conto_carta = str(row.get('Conto o carta', '')).strip()
-                categoria = str(row.get('Categoria', '')).strip()
-                valuta = str(row.get('Valuta', 'EUR')).strip()
-                importo = parse_importo(row.get('Importo', 0))
+    rows = df[['data_valuta', 'operazione', 'conto_carta', 'categoria', 'valuta', 'importo', 'is_neutral']]
 
-                if not operazione or operazione == 'nan':
-                    continue
+    to_insert = []
 
-                if conto_carta == 'nan': conto_carta = ''
-                if categoria == 'nan': categoria = ''
-                if valuta == 'nan': valuta = 'EUR'
+    try:
+        # Take the write lock up front: the duplicate index and the insert
+        # then see the same table, with no other writer in between.
+        conn.execute("BEGIN IMMEDIATE")
+
+        # One query replaces the per-row exact and fuzzy duplicate lookups.
+        # hash_id covers data_valuta, so only rows dated around the file's
+        # range can match either way.
+        known_hashes, fuzzy_days = set(), {}
+        if not rows.empty:
+            known_hashes, fuzzy_days = load_duplicate_index(
+                conn, rows['data_valuta'].min(), rows['data_valuta'].max()
+            )
 
+        for data_valuta, operazione, conto_carta, categoria, valuta, importo, is_neutral \
+                in rows.itertuples(index=False, name=None):
+            try:
                 hash_id = generate_hash(data_valuta, importo, operazione, conto_carta)
 
-                existing = conn.execute(
-                    "SELECT id FROM expenses WHERE hash_id = ?", (hash_id,)
-                ).fetchone()
-
-                if existing:
+                if hash_id in known_hashes:
                     stats["duplicates"] += 1
                     continue
 
-                if check_fuzzy_duplicate(conn, data_valuta, importo, operazione):
+                day = date.fromisoformat(data_valuta).toordinal()
+                if check_fuzzy_duplicate(fuzzy_days, day, importo, operazione):
                     stats["fuzzy_matches"].append({
                         "data": data_valuta,
                         "operazione": operazione,
@@ -246,21 +483,33 @@ def process_excel(file_bytes: bytes) -> dict:
                     stats["duplicates"] += 1
                     continue
 
-                is_neutral = 1 if check_neutral(operazione, neutral_kws) else 0
-
-                conn.execute("""
-                    INSERT INTO expenses
-                        (data_valuta, operazione, conto_carta, categoria, valuta, importo, hash_id, is_neutral)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (data_valuta, operazione, conto_carta, categoria, valuta, importo, hash_id, is_neutral))
-
-                stats["new"] += 1
+                to_insert.append(
+                    (data_valuta, operazione, conto_carta, categoria, valuta, importo, hash_id, is_neutral)
+                )
+                # Rows accepted from this file join the index, so in-file
+                # exact and fuzzy duplicates are still caught.
+                known_hashes.add(hash_id)
+                if importo != 0:
+                    insort(fuzzy_days.setdefault((importo, operazione.lower()), []), day)
 
             except Exception:
                 stats["errors"] += 1
                 continue
 
+        # One statement and one transaction for the whole file
+        cur = conn.executemany("""
+            INSERT OR IGNORE INTO expenses
+                (data_valuta, operazione, conto_carta, categoria, valuta, importo, hash_id, is_neutral)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, to_insert)
         conn.commit()
+        invalidate_expenses_cache()
+        # rowcount skips ignored rows and the expenses_fts trigger writes
+        stats["new"] = cur.rowcount
+        stats["duplicates"] += len(to_insert) - stats["new"]
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
@@ -271,9 +520,8 @@ def process_excel(file_bytes: bytes) -> dict:
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
-    """Serve the main HTML page."""
-    with open("frontend/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+    """Serve the main HTML page (read once at startup)."""
+    return HTMLResponse(content=app.state.index_html, headers=INDEX_HEADERS)
 
 
 @app.post("/upload")
@@ -285,9 +533,11 @@ async def upload_file(file: UploadFile = File(...)):
             content={"error": "Solo file .xlsx sono accettati."}
         )
 
-    file_bytes = await file.read()
+    # UploadFile is already spooled to a temp file by Starlette (on disk past
+    # 1 MB): hand that file to the parser instead of a bytes copy of it
+    await file.seek(0)
     try:
-        stats = process_excel(file_bytes)
+        stats = process_excel(file.file)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -297,25 +547,25 @@ async def upload_file(file: UploadFile = File(...)):
     return stats
 
 
-@app.get("/expenses")
-async def get_expenses(
-    search_text: str = Query(default=None),
-    start_date: str = Query(default=None),
-    end_date: str = Query(default=None)
-):
-    """
-    Get all expenses, optionally filtered, grouped by Year > Month.
-    Returns: { "2026": { "Febbraio": [...], "Gennaio": [...] }, ... }
-    """
+def load_grouped_expenses(search_text: str, start_date: str, end_date: str) -> dict:
+    """Query expenses with the /expenses filters and group them by Year > Month."""
     conn = get_db_connection()
 
     query = "SELECT * FROM expenses WHERE 1=1"
     params = []
 
     if search_text:
-        query += " AND (LOWER(operazione) LIKE ? OR LOWER(categoria) LIKE ? OR LOWER(conto_carta) LIKE ?)"
-        like_param = f"%{search_text.lower()}%"
-        params.extend([like_param, like_param, like_param])
+        needle = search_text.lower()
+        if len(needle) >= 3 and '%' not in needle and '_' not in needle:
+            # Substring match on all three columns via the trigram index
+            # (a quoted phrase matches any run of characters in a column)
+            query += " AND id IN (SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ?)"
+            params.append('"' + needle.replace('"', '""') + '"')
+        else:
+            # Trigram phrases need 3+ chars and have no LIKE wildcards
+            query += " AND (LOWER(operazione) LIKE ? OR LOWER(categoria) LIKE ? OR LOWER(conto_carta) LIKE ?)"
+            like_param = f"%{needle}%"
+            params.extend([like_param, like_param, like_param])
 
     if start_date:
         query += " AND data_valuta >= ?"
@@ -327,55 +577,96 @@ async def get_expenses(
 
     query += " ORDER BY data_valuta DESC"
 
-    rows = conn.execute(query, params).fetchall()
+    # Plain tuples: the rows are zipped with the column names below, so the
+    # connection's sqlite3.Row wrapper would only be built and thrown away
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(query, params)
+    # Column names once per query; dict(zip()) is cheaper than dict(Row) per row
+    cols = [d[0] for d in cur.description]
+    rows = cur.fetchall()
     conn.close()
 
-    grouped = defaultdict(lambda: defaultdict(list))
+    # Rows arrive newest first, so a single pass creates the year and month
+    # buckets already in display order: no regrouping or re-sorting needed.
+    # data_valuta is stored as 'YYYY-MM-DD', so slicing replaces strptime;
+    # strptime is only the fallback for older unpadded dates ('2024-1-7').
+    result = {}
+    current_key = current = None
     for row in rows:
-        row_dict = dict(row)
+        row_dict = dict(zip(cols, row))
         date_str = row_dict['data_valuta']
         try:
-            dt = datetime.strptime(date_str, '%Y-%m-%d')
-            year = str(dt.year)
-            month = MONTH_NAMES_IT.get(dt.month, str(dt.month))
-        except ValueError:
-            year = "Sconosciuto"
-            month = "Sconosciuto"
-
-        grouped[year][month].append(row_dict)
+            year, month = date_str[:4], MONTH_NAMES_IT[int(date_str[5:7])]
+        except (ValueError, KeyError):
+            try:
+                parsed = datetime.strptime(date_str, '%Y-%m-%d')
+                year, month = str(parsed.year), MONTH_NAMES_IT[parsed.month]
+            except (ValueError, TypeError):
+                year = "Sconosciuto"
+                month = "Sconosciuto"
 
-    result = {}
-    for year in sorted(grouped.keys(), reverse=True):
-        months_data = grouped[year]
-        month_order = {v: k for k, v in MONTH_NAMES_IT.items()}
-        sorted_months = sorted(
-            months_data.keys(),
-            key=lambda m: month_order.get(m, 0),
-            reverse=True
-        )
-        result[year] = {}
-        for month in sorted_months:
-            result[year][month] = months_data[month]
+        if (year, month) != current_key:
+            current_key = (year, month)
+            current = result.setdefault(year, {}).setdefault(month, [])
+        current.append(row_dict)
 
     return result
 
 
+@app.get("/expenses")
+async def get_expenses(
+    request: Request,
+    search_text: str = Query(default=None),
+    start_date: str = Query(default=None),
+    end_date: str = Query(default=None)
+):
+    """
+    Get all expenses, optionally filtered, grouped by Year > Month.
+    Returns: { "2026": { "Febbraio": [...], "Gennaio": [...] }, ... }
+    Served from the response cache (or as a 304) until expenses change.
+    """
+    cache_key = (search_text, start_date, end_date)
+    with _expenses_lock:
+        generation = _expenses_generation
+        body = _expenses_cache.get(cache_key)
+        if body is not None:
+            _expenses_cache.move_to_end(cache_key)
+
+    headers = {"ETag": f'"{EXPENSES_ETAG_PREFIX}-{generation}"', "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    if body is None:
+        body = orjson.dumps(load_grouped_expenses(search_text, start_date, end_date))
+        with _expenses_lock:
+            if generation == _expenses_generation:
+                _expenses_cache[cache_key] = body
+                if len(_expenses_cache) > EXPENSES_CACHE_SIZE:
+                    _expenses_cache.popitem(last=False)
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.patch("/expenses/{expense_id}/toggle")
 async def toggle_expense(expense_id: int):
     """Toggle the is_excluded flag for a given expense."""
     conn = get_db_connection()
 
-    row = conn.execute("SELECT is_excluded FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+    # Flip and read back in one statement (RETURNING needs SQLite >= 3.35)
+    row = conn.execute("""
+        UPDATE expenses SET is_excluded = CASE WHEN is_excluded THEN 0 ELSE 1 END
+        WHERE id = ?
+        RETURNING is_excluded
+    """, (expense_id,)).fetchone()
     if not row:
         conn.close()
         return JSONResponse(status_code=404, content={"error": "Spesa non trovata."})
 
-    new_value = 0 if row['is_excluded'] else 1
-    conn.execute("UPDATE expenses SET is_excluded = ? WHERE id = ?", (new_value, expense_id))
     conn.commit()
+    invalidate_expenses_cache()
     conn.close()
 
-    return {"id": expense_id, "is_excluded": bool(new_value)}
+    return {"id": expense_id, "is_excluded": bool(row['is_excluded'])}
 
 
 @app.patch("/expenses/{expense_id}")
@@ -433,6 +724,7 @@ async def update_expense(expense_id: int, request: Request):
             WHERE id = ?
         """, (data_valuta, operazione, conto_carta, categoria, importo, new_hash, is_neutral, expense_id))
         conn.commit()
+        invalidate_expenses_cache()
 
         # Return updated row
         row = conn.execute(
@@ -484,6 +776,7 @@ async def create_expense(request: Request):
             VALUES (?, ?, ?, ?, 'EUR', ?, ?, ?)
         """, (data_valuta, operazione, conto_carta, categoria, importo, hash_id, is_neutral))
         conn.commit()
+        invalidate_expenses_cache()
 
         row = conn.execute(
             "SELECT * FROM expenses WHERE hash_id = ?", (hash_id,)
@@ -544,33 +837,53 @@ async def get_dashboard_stats(
 
     start_date, end_date = month_date_range(year, month)
 
-    totals = conn.execute("""
+    # One range scan: the month's rows are materialised once and feed both
+    # the totals row (kind 'totals') and the top-3 expense categories (kind
+    # 'category'). Each kind fills its own columns and leaves the rest NULL.
+    rows = conn.execute("""
+        WITH month_rows AS MATERIALIZED (
+            SELECT categoria, importo
+            FROM expenses
+            WHERE data_valuta >= ? AND data_valuta < ?
+              AND is_excluded = 0
+              AND is_neutral = 0
+        )
         SELECT
+            'totals' as kind,
+            NULL as categoria,
+            NULL as totale,
             COALESCE(SUM(CASE WHEN importo > 0 THEN importo ELSE 0 END), 0) as entrate,
             COALESCE(SUM(CASE WHEN importo < 0 THEN importo ELSE 0 END), 0) as uscite,
             COALESCE(SUM(importo), 0) as saldo,
             COUNT(*) as count
-        FROM expenses
-        WHERE data_valuta >= ? AND data_valuta < ?
-          AND is_excluded = 0
-          AND is_neutral = 0
-    """, (start_date, end_date)).fetchone()
-
-    top_categories = conn.execute("""
-        SELECT categoria, SUM(ABS(importo)) as totale
-        FROM expenses
-        WHERE data_valuta >= ? AND data_valuta < ?
-          AND is_excluded = 0
-          AND is_neutral = 0
-          AND importo < 0
-          AND categoria != '' AND categoria IS NOT NULL
-        GROUP BY categoria
-        ORDER BY totale DESC
-        LIMIT 3
+        FROM month_rows
+        UNION ALL
+        SELECT kind, categoria, totale, entrate, uscite, saldo, count FROM (
+            SELECT
+                'category' as kind,
+                categoria,
+                SUM(ABS(importo)) as totale,
+                NULL as entrate,
+                NULL as uscite,
+                NULL as saldo,
+                NULL as count
+            FROM month_rows
+            WHERE importo < 0
+              AND categoria != '' AND categoria IS NOT NULL
+            GROUP BY categoria
+            ORDER BY totale DESC
+            LIMIT 3
+        )
     """, (start_date, end_date)).fetchall()
 
     conn.close()
 
+    totals = next(r for r in rows if r['kind'] == 'totals')
+    top_categories = sorted(
+        ((r['categoria'], r['totale']) for r in rows if r['kind'] == 'category'),
+        key=lambda c: c[1], reverse=True
+    )
+
     return {
         "year": year,
         "month": month,
@@ -580,8 +893,8 @@ async def get_dashboard_stats(
         "saldo": round(totals['saldo'], 2),
         "count": totals['count'],
         "top_categories": [
-            {"categoria": row['categoria'], "totale": round(row['totale'], 2)}
-            for row in top_categories
+            {"categoria": categoria, "totale": round(totale, 2)}
+            for categoria, totale in top_categories
         ]
     }
 
@@ -592,13 +905,12 @@ async def get_dashboard_stats(
 async def get_monthly_status():
     """Return paid/unpaid status for every month."""
     conn = get_db_connection()
-    rows = conn.execute("SELECT month, year, is_paid FROM monthly_status").fetchall()
+    # SQLite formats the "YYYY-MM" key, leaving only dict insertion in Python
+    rows = conn.execute(
+        "SELECT printf('%d-%02d', year, month), is_paid FROM monthly_status"
+    ).fetchall()
     conn.close()
-    result = {}
-    for r in rows:
-        key = f"{r['year']}-{r['month']:02d}"
-        result[key] = bool(r['is_paid'])
-    return result
+    return {key: bool(is_paid) for key, is_paid in rows}
 
 
 @app.post("/monthly-status")
@@ -630,24 +942,26 @@ async def bulk_delete_expenses(request: Request):
     if not periods:
         return JSONResponse(status_code=400, content={"error": "Nessun periodo specificato."})
 
-    conn = get_db_connection()
-    total_deleted = 0
-
-    for p in periods:
-        m, y = int(p["month"]), int(p["year"])
-        start_date, end_date = month_date_range(y, m)
+    month_years = [(int(p["month"]), int(p["year"])) for p in periods]
+    date_params = [d for m, y in month_years for d in month_date_range(y, m)]
 
-        cur = conn.execute(
-            "DELETE FROM expenses WHERE data_valuta >= ? AND data_valuta < ?",
-            (start_date, end_date)
-        )
-        total_deleted += cur.rowcount
-        conn.execute(
-            "DELETE FROM monthly_status WHERE month = ? AND year = ?",
-            (m, y)
-        )
+    # One statement per table: the OR of date ranges is still served by
+    # idx_expenses_data (multi-index OR), one range scan per period.
+    conn = get_db_connection()
+    cur = conn.execute(
+        "DELETE FROM expenses WHERE "
+        + " OR ".join(["(data_valuta >= ? AND data_valuta < ?)"] * len(month_years)),
+        date_params
+    )
+    total_deleted = cur.rowcount
+    conn.execute(
+        "DELETE FROM monthly_status WHERE (month, year) IN (VALUES "
+        + ", ".join(["(?, ?)"] * len(month_years)) + ")",
+        [v for pair in month_years for v in pair]
+    )
 
     conn.commit()
+    invalidate_expenses_cache()
     conn.close()
     return {"deleted": total_deleted}
 
@@ -665,6 +979,7 @@ async def delete_expense(expense_id: int):
 
     conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
     conn.commit()
+    invalidate_expenses_cache()
     conn.close()
     return {"deleted": expense_id}
 
@@ -702,6 +1017,8 @@ async def add_keyword(request: Request):
             (keyword.lower(),)
         )
         conn.commit()
+        invalidate_neutral_keywords()
+        invalidate_expenses_cache()
         row = conn.execute(
             "SELECT id, keyword FROM neutral_keywords WHERE keyword = ?", (keyword,)
         ).fetchone()
@@ -731,6 +1048,8 @@ async def delete_keyword(kw_id: int):
     conn.execute("UPDATE rimborso_mittenti SET keyword_id = NULL WHERE keyword_id = ?", (kw_id,))
     conn.commit()
     conn.close()
+    invalidate_neutral_keywords()
+    invalidate_expenses_cache()
     return {"deleted": kw_id}
 
 
@@ -783,6 +1102,8 @@ async def add_rimborso_mittente(request: Request):
             (operazione, keyword_id, tolleranza, attivo)
         )
         conn.commit()
+        invalidate_neutral_keywords()
+        invalidate_expenses_cache()
         row = conn.execute(
             "SELECT * FROM rimborso_mittenti WHERE operazione = ?", (operazione,)
         ).fetchone()
@@ -828,6 +1149,8 @@ async def delete_rimborso_mittente(mid: int):
         )
     conn.commit()
     conn.close()
+    invalidate_neutral_keywords()
+    invalidate_expenses_cache()
     return {"deleted": mid}
 
 
@@ -848,23 +1171,21 @@ async def detect_rimborso():
         for r in conn.execute("SELECT year, month FROM monthly_status WHERE is_paid = 1").fetchall()
     }
 
-    expense_months_rows = conn.execute("""
-        SELECT DISTINCT
+    # All monthly totals in one grouped scan instead of one SUM query per month
+    month_totals = conn.execute("""
+        SELECT
             CAST(strftime('%Y', data_valuta) AS INTEGER) AS year,
-            CAST(strftime('%m', data_valuta)  AS INTEGER) AS month
-        FROM expenses WHERE is_neutral = 0 ORDER BY year, month
+            CAST(strftime('%m', data_valuta)  AS INTEGER) AS month,
+            SUM(importo) AS total
+        FROM expenses WHERE is_excluded = 0 AND is_neutral = 0
+        GROUP BY year, month ORDER BY year, month
     """).fetchall()
 
     unpaid = []
-    for r in expense_months_rows:
-        y, m = r["year"], r["month"]
+    for r in month_totals:
+        y, m, total = r["year"], r["month"], r["total"]
         if (y, m) in paid_keys:
             continue
-        sd, ed = month_date_range(y, m)
-        total = conn.execute("""
-            SELECT COALESCE(SUM(importo),0) AS t FROM expenses
-            WHERE data_valuta >= ? AND data_valuta < ? AND is_excluded=0 AND is_neutral=0
-        """, (sd, ed)).fetchone()["t"]
         if abs(total) > 0.01:
             unpaid.append({"year": y, "month": m,
                            "month_name": MONTH_NAMES_IT.get(m, str(m)),
@@ -874,48 +1195,49 @@ async def detect_rimborso():
         conn.close()
         return {"candidates": []}
 
+    # unpaid is already chronological (ORDER BY year, month), so the months
+    # before a transaction are always a prefix: one bisect per transaction
+    unpaid_cutoffs = [f"{m['year']}-{m['month']:02d}-28" for m in unpaid]
+    unpaid_amounts = [m["amount"] for m in unpaid]
+
     candidates = []
     seen_tx_ids = set()
 
-    for mit in mittenti:
-        pattern, tolleranza = mit["operazione"], mit["tolleranza"]
-        txs = conn.execute("""
-            SELECT id, data_valuta, operazione, importo FROM expenses
-            WHERE LOWER(TRIM(operazione)) LIKE ? AND importo > 0
-            ORDER BY data_valuta DESC
-        """, (f"%{pattern.lower()}%",)).fetchall()
-
-        for tx in txs:
-            if tx["id"] in seen_tx_ids:
-                continue
-            tx_amount, tx_date = tx["importo"], tx["data_valuta"]
-            # Solo mesi PRECEDENTI alla data del bonifico
-            eligible = [m for m in unpaid if f"{m['year']}-{m['month']:02d}-28" < tx_date]
-            if not eligible:
-                continue
+    # Every mittente's transactions in one round trip: each UNION ALL branch
+    # is a substring match served by the trigram index on expenses_fts,
+    # tagged with the mittente's position to keep the per-mittente order
+    txs = conn.execute(" UNION ALL ".join(["""
+        SELECT ? AS mit_idx, e.id, e.data_valuta, e.operazione, e.importo
+        FROM expenses_fts f JOIN expenses e ON e.id = f.rowid
+        WHERE f.operazione LIKE ? AND e.importo > 0
+    """] * len(mittenti)) + " ORDER BY mit_idx, data_valuta DESC", [
+        param
+        for mit_idx, mit in enumerate(mittenti)
+        for param in (mit_idx, f"%{mit['operazione'].lower()}%")
+    ]).fetchall()
+
+    for mit_idx, tx_id, tx_date, tx_operazione, tx_amount in txs:
+        if tx_id in seen_tx_ids:
+            continue
+        # Solo mesi PRECEDENTI alla data del bonifico
+        cut = bisect_left(unpaid_cutoffs, tx_date)
+        if not cut:
+            continue
 
-            # Ordina cronologicamente per considerare solo finestre contigue
-            eligible_sorted = sorted(eligible, key=lambda m: (m["year"], m["month"]))
-
-            best = None
-            # Itera su tutti i sottoinsiemi CONTIGUI (finestre consecutive) di lunghezza 1..4
-            for start_idx in range(len(eligible_sorted)):
-                cumulative = 0.0
-                for end_idx in range(start_idx, min(start_idx + 4, len(eligible_sorted))):
-                    combo = eligible_sorted[start_idx:end_idx + 1]
-                    cumulative = sum(m["amount"] for m in combo)
-                    diff = abs(abs(cumulative) - tx_amount)
-                    if diff <= tolleranza and (best is None or diff < best["diff"]):
-                        best = {
-                            "transaction": dict(tx),
-                            "months": list(combo),
-                            "months_total": round(cumulative, 2),
-                            "diff": round(diff, 2)
-                        }
-
-            if best:
-                seen_tx_ids.add(tx["id"])
-                candidates.append(best)
+        # Finestre CONTIGUE di lunghezza 1..4 sui soli importi; il
+        # candidato viene costruito solo per la finestra migliore
+        best = find_best_window(unpaid_amounts[:cut], tx_amount, mittenti[mit_idx]["tolleranza"])
+
+        if best:
+            start_idx, end_idx, cumulative, diff = best
+            seen_tx_ids.add(tx_id)
+            candidates.append({
+                "transaction": {"id": tx_id, "data_valuta": tx_date,
+                                "operazione": tx_operazione, "importo": tx_amount},
+                "months": unpaid[start_idx:end_idx + 1],
+                "months_total": round(cumulative, 2),
+                "diff": diff
+            })
 
     conn.close()
     return {"candidates": candidates}
@@ -2,20 +2,64 @@
 Database models and initialization for the Expense Management App.
 Uses SQLite for lightweight, file-based persistence.
 """
+import atexit
 import sqlite3
 import os
+import threading
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'expenses.db')
 
+# expenses columns mirrored into the expenses_fts trigram index
+FTS_COLUMNS = ('operazione', 'categoria', 'conto_carta')
+
+# One long-lived connection per thread: the PRAGMAs run once and the page
+# cache stays warm across requests.
+_local = threading.local()
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection handed out by get_db_connection().
+    close() only returns it to the thread's pool, rolling back anything left
+    uncommitted; close_db_connection() really closes it.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
 
 def get_db_connection():
-    """Get a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+    """Get this thread's connection to the SQLite database."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+
+    conn = sqlite3.connect(DB_PATH, factory=PooledConnection)
     conn.row_factory = sqlite3.Row  # Return rows as dicts
     conn.execute("PRAGMA journal_mode=WAL")  # Better concurrent read performance
+    conn.execute("PRAGMA synchronous=NORMAL")  # WAL-safe: no fsync on every commit
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache (negative = KiB)
+    conn.execute("PRAGMA mmap_size=268435456")  # Read pages via a 256 MiB memory map
+    _local.conn = conn
     return conn
 
 
+def close_db_connection():
+    """Close this thread's pooled connection, if any."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        sqlite3.Connection.close(conn)
+
+
+# Scripts calling init_db() etc. outside the server never run the lifespan
+# shutdown: close the main thread's connection at exit so the WAL is
+# checkpointed and its -wal/-shm files removed.
+atexit.register(close_db_connection)
+
+
 def init_db():
     """Initialize the database schema. Creates tables if they don't exist."""
     # Ensure the data directory exists
@@ -50,11 +94,53 @@ def init_db():
         CREATE INDEX IF NOT EXISTS idx_expenses_data
         ON expenses(data_valuta DESC)
     """)
+    # hash_id is declared UNIQUE, so SQLite already maintains an index for it
+    cursor.execute("DROP INDEX IF EXISTS idx_expenses_hash")
+    # Expression index for the case-insensitive operazione matches used by
+    # neutral keywords and rimborso mittenti
     cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_expenses_hash
-        ON expenses(hash_id)
+        CREATE INDEX IF NOT EXISTS idx_expenses_op_norm
+        ON expenses(LOWER(TRIM(operazione)))
     """)
 
+    # Trigram full-text index over the searchable text columns: serves
+    # substring LIKE / MATCH lookups without scanning the whole expenses
+    # table. Triggers keep the external-content index in sync with expenses.
+    fts_columns = [r[1] for r in cursor.execute("PRAGMA table_info(expenses_fts)")]
+    if fts_columns != list(FTS_COLUMNS):
+        # Migration: missing or built with other columns, (re)index from expenses
+        cursor.execute("DROP TABLE IF EXISTS expenses_fts")
+        for trigger in ('expenses_fts_ai', 'expenses_fts_ad', 'expenses_fts_au'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+        columns = ", ".join(FTS_COLUMNS)
+        new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+        old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE expenses_fts USING fts5(
+                {columns}, content='expenses', content_rowid='id', tokenize='trigram'
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER expenses_fts_ai AFTER INSERT ON expenses BEGIN
+                INSERT INTO expenses_fts (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER expenses_fts_ad AFTER DELETE ON expenses BEGIN
+                INSERT INTO expenses_fts (expenses_fts, rowid, {columns})
+                VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER expenses_fts_au AFTER UPDATE OF {columns} ON expenses BEGIN
+                INSERT INTO expenses_fts (expenses_fts, rowid, {columns})
+                VALUES ('delete', old.id, {old_values});
+                INSERT INTO expenses_fts (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        """)
+        cursor.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS monthly_status (
             month INTEGER NOT NULL,
@@ -81,5 +167,8 @@ def init_db():
         )
     """)
 
+    # Refresh planner statistics so the indexes above are actually chosen
+    cursor.execute("ANALYZE")
+
     conn.commit()
     conn.close()
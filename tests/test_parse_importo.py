@@ -0,0 +1,40 @@
+import math
+import unittest
+
+import pandas as pd
+
+from backend.main import parse_importo, parse_importo_column
+
+# Strings where pd.to_numeric and float() disagree, plus the usual formats
+AMOUNTS = [
+    '1_000', '-1_234,5', 'nan', 'NaN', '-nan', 'inf', '-Infinity', '1e3',
+    '1.200,50', '€ 12,30', '-45,00', '10.3', ' -4,5 €', '+7', '$ 3',
+    '12345678901234567890', '1.2.3', '1,2,3', '0x10', 'abc', '', '   ',
+]
+
+
+class ParseImportoColumnTest(unittest.TestCase):
+    def assertSameAmounts(self, values):
+        expected = [parse_importo(v) for v in values]
+        actual = parse_importo_column(pd.Series(values, dtype=object)).tolist()
+        for value, want, got in zip(values, expected, actual):
+            with self.subTest(value=value):
+                if math.isnan(want):
+                    self.assertTrue(math.isnan(got))
+                else:
+                    self.assertEqual(want, got)
+
+    def test_strings_match_parse_importo(self):
+        self.assertSameAmounts(AMOUNTS)
+
+    def test_mixed_cells_match_parse_importo(self):
+        self.assertSameAmounts(AMOUNTS + [12, -3.5, 0, True])
+
+    def test_empty_cells_stay_nan(self):
+        parsed = parse_importo_column(pd.Series(['1,5', float('nan'), None], dtype=object))
+        self.assertEqual(parsed[0], 1.5)
+        self.assertTrue(parsed[1:].isna().all())
+
+
+if __name__ == '__main__':
+    unittest.main()